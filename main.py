@@ -8,18 +8,24 @@ from whochat.rpc.clients.websocket import (
     OneBotWebsocketRPCClient,
 )
 
-from wechatbot.bot import global_context, on_message
+from wechatbot.bot import global_context, migrate_revoke_hashes, on_message
 from wechatbot.settings import settings
 
 logger = logging.getLogger("wechatbot")
 
 
-async def main():
-    bot_rpc_client = BotWebsocketRPCClient(settings.BOT_WEBSOCKET_RPC_ADDRESS)
+async def main(
+    bot_rpc_client=None,
+    message_client=None,
+    one_bot_client_class=OneBotWebsocketRPCClient,
+):
+    bot_rpc_client = bot_rpc_client or BotWebsocketRPCClient(
+        settings.BOT_WEBSOCKET_RPC_ADDRESS
+    )
     bot_rpc_client.consume_in_background()
     results = await bot_rpc_client.list_wechat()
     pid = int(results[0]["pid"])
-    o = OneBotWebsocketRPCClient(pid, bot_rpc_client)
+    o = one_bot_client_class(pid, bot_rpc_client)
     self_info = await o.get_self_info()
     logger.info(self_info)
     image_hook_path = await o.hook_image_msg("Images")
@@ -30,10 +36,31 @@ async def main():
     global_context["image_hook_path"] = image_hook_path
     global_context["voice_hook_path"] = voice_hook_path
     global_context["wechat_base_path"] = wechat_base_path
-    message_client = WechatMessageWebsocketClient(settings.WECHAT_MESSAGE_RPC_ADDRESS)
+    await migrate_revoke_hashes()
+    message_client = message_client or WechatMessageWebsocketClient(
+        settings.WECHAT_MESSAGE_RPC_ADDRESS
+    )
 
-    await message_client.start_consumer(partial(on_message, o=o))
+    if settings.WORKERS > 0:
+        from wechatbot.workers import Ingress
+
+        await Ingress(settings.WORKERS).run(o, message_client, global_context)
+    else:
+        await message_client.start_consumer(partial(on_message, o=o))
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    if settings.SIMULATION_PROFILE:
+        from wechatbot.simulation import LinkProfile, simulate
+
+        simulate(
+            main,
+            settings.SIMULATION_PROFILE,
+            seed=settings.SIMULATION_SEED,
+            link=LinkProfile(
+                latency=settings.SIMULATION_RPC_LATENCY,
+                fault_rate=settings.SIMULATION_FAULT_RATE,
+            ),
+        )
+    else:
+        asyncio.run(main())
@@ -0,0 +1,79 @@
+import asyncio
+import datetime
+import json
+
+import pytest
+
+from wechatbot import bot
+from wechatbot.revoke_archive import RevokeArchive
+from wechatbot.settings import settings
+from wechatbot.simulation import SimulatedRedis, make_message
+
+
+class RecordingClient:
+    def __init__(self):
+        self.sent = []
+
+    async def send_text(self, wxid, text):
+        self.sent.append((wxid, text))
+
+
+@pytest.fixture
+def revoke_archive(tmp_path, monkeypatch):
+    archive = RevokeArchive(tmp_path)
+    monkeypatch.setattr(bot, "revoke_archive", archive)
+    yield archive
+    archive.close()
+
+
+@pytest.fixture
+def redis_client(monkeypatch):
+    client = SimulatedRedis()
+    monkeypatch.setattr(bot, "redis_client", client)
+    return client
+
+
+def revokes_message(text, at_user_list=None):
+    return make_message("1@chatroom", "wxid_admin", text, at_user_list=at_user_list)
+
+
+def test_revokes_mention_with_space(revoke_archive, monkeypatch):
+    monkeypatch.setattr(settings, "ADMIN_WXIDS", ["wxid_admin"])
+    revoke_archive.add(1, "wxid_john", "1@chatroom", 1, json.dumps({"message": "秘密"}))
+    o = RecordingClient()
+    message = revokes_message(
+        "/revokes @John Smith\u2005today", at_user_list=["wxid_john"]
+    )
+
+    asyncio.run(bot.RevokeQuerier().consume(o, message))
+
+    assert len(o.sent) == 1
+    wxid, text = o.sent[0]
+    assert wxid == "wxid_admin"
+    assert "wxid_john" in text and "秘密" in text
+
+
+def test_revokes_command_must_match_exactly(revoke_archive, monkeypatch):
+    monkeypatch.setattr(settings, "ADMIN_WXIDS", ["wxid_admin"])
+    o = RecordingClient()
+
+    asyncio.run(bot.RevokeQuerier().consume(o, revokes_message("/revokesfoo today")))
+
+    assert o.sent == []
+
+
+def test_migrate_skips_malformed_keys(revoke_archive, redis_client):
+    today = datetime.date.today()
+    revoked_msg = json.dumps({"type": 1, "sender": "1@chatroom", "message": "旧"})
+
+    async def migrate():
+        await redis_client.hset(f"revoke:{today}:wxid_a", 1, revoked_msg)
+        await redis_client.hset("revoke:not-a-date:wxid_b", 2, revoked_msg)
+        await redis_client.hset("revoke:broken", 3, revoked_msg)
+        await bot.migrate_revoke_hashes()
+
+    asyncio.run(migrate())
+
+    records = revoke_archive.query(today)
+    assert [record["msgid"] for record in records] == [1]
+    assert records[0]["chatroom_id"] == "1@chatroom"
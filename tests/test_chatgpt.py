@@ -0,0 +1,97 @@
+import copyreg
+import pickle
+from collections import defaultdict
+
+import pytest
+import requests
+
+from wechatbot import chatgpt as chatgpt_module
+from wechatbot.chatgpt import ChatGPT, Chatroom, ChatroomStore
+from wechatbot.os_signals import Signal
+
+
+@pytest.fixture(autouse=True)
+def signal_handlers(monkeypatch):
+    monkeypatch.setattr(Signal, "_signal_handlers", defaultdict(dict))
+    monkeypatch.setattr(Signal, "signalled", True)
+
+
+@pytest.fixture
+def chatgpt(tmp_path):
+    chatgpt = ChatGPT(
+        session=requests.Session(),
+        pickle_file=str(tmp_path.joinpath("chatgpt.pickle")),
+        max_chatrooms=2,
+    )
+    yield chatgpt
+    chatgpt.chatroom_store.close()
+
+
+def test_evict_and_reload(chatgpt):
+    chatgpt.update_chatroom("a", {"id": "m1", "text": "你好"})
+    chatgpt.get_chatroom("b")
+    chatgpt.get_chatroom("c")
+    assert list(chatgpt.chatrooms) == ["b", "c"]
+    assert len(chatgpt.chatroom_store) == 1
+
+    chatroom = chatgpt.get_chatroom("a")
+    assert chatroom.current_message_id == "m1"
+    assert chatroom.current_message == "你好"
+    assert list(chatgpt.chatrooms) == ["c", "a"]
+    # a已从磁盘取出，b被换出
+    assert len(chatgpt.chatroom_store) == 1
+    assert chatgpt.chatroom_store.pop("a") is None
+
+
+def test_get_moves_to_end(chatgpt):
+    chatgpt.get_chatroom("a")
+    chatgpt.get_chatroom("b")
+    chatgpt.get_chatroom("a")
+    chatgpt.get_chatroom("c")
+    assert list(chatgpt.chatrooms) == ["a", "c"]
+    assert chatgpt.chatroom_store.pop("b") == Chatroom(id="b")
+
+
+def test_store_ttl(tmp_path, monkeypatch):
+    store = ChatroomStore(str(tmp_path.joinpath("chatrooms.sqlite3")), ttl=60)
+    monkeypatch.setattr(chatgpt_module.time, "time", lambda: 1000.0)
+    store.put_many([Chatroom(id="a")])
+    monkeypatch.setattr(chatgpt_module.time, "time", lambda: 1100.0)
+    store.put_many([Chatroom(id="b")])
+
+    assert len(store) == 1
+    assert store.pop("a") is None
+    assert store.pop("b") == Chatroom(id="b")
+    store.close()
+
+
+class PreSlotsChatroom:
+    """没有__slots__时Chatroom的pickle格式"""
+
+    def __init__(self, **state):
+        self.state = state
+
+    def __reduce_ex__(self, protocol):
+        return copyreg._reconstructor, (Chatroom, object, None), self.state
+
+
+def test_load_pre_slots_pickle():
+    data = pickle.dumps(
+        PreSlotsChatroom(
+            id="a", current_message_id="m1", current_message="你好", initial_prompt=None
+        )
+    )
+    assert pickle.loads(data) == Chatroom(
+        id="a", current_message_id="m1", current_message="你好"
+    )
+
+
+def test_pickle_round_trip(chatgpt):
+    for chatroom_id in "abc":
+        chatgpt.get_chatroom(chatroom_id)
+    chatgpt.save()
+
+    loaded = ChatGPT.load(chatgpt.pickle_file)
+    assert list(loaded.chatrooms) == ["b", "c"]
+    assert loaded.chatroom_store.pop("a") == Chatroom(id="a")
+    loaded.chatroom_store.close()
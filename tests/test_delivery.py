@@ -0,0 +1,73 @@
+import asyncio
+
+from wechatbot import bot
+from wechatbot.delivery import ReplyDelivery, split_text
+
+
+class RecordingConsumer:
+    async def send_at_text(self, o, chatroom_id, at_wxids, text):
+        await o.send_at_text(chatroom_id, at_wxids, text)
+
+    async def send_text(self, o, chatroom_id, text):
+        await o.send_text(chatroom_id, text)
+
+
+class RecordingClient:
+    def __init__(self, file_error: Exception = None):
+        self.file_error = file_error
+        self.sent = []
+
+    async def send_at_text(self, chatroom_id, at_wxids, text):
+        self.sent.append(("send_at_text", text))
+
+    async def send_text(self, wxid, text):
+        self.sent.append(("send_text", text))
+
+    async def send_file(self, wxid, filepath):
+        if self.file_error:
+            raise self.file_error
+        self.sent.append(("send_file", filepath))
+
+
+def long_text(sentences: int) -> str:
+    return "".join(f"第{i}句。" for i in range(sentences))
+
+
+def test_split_text_on_boundaries():
+    text = long_text(100)
+    chunks = split_text(text, 100)
+    assert "".join(chunks) == text
+    assert all(len(chunk) <= 100 and chunk.endswith("。") for chunk in chunks)
+
+
+def test_send_file(tmp_path):
+    delivery = ReplyDelivery(file_threshold=500, file_dir=tmp_path)
+    o = RecordingClient()
+    text = long_text(200)
+
+    sends = asyncio.run(
+        delivery.deliver(RecordingConsumer(), o, "1@chatroom", "a", text)
+    )
+
+    assert sends == 2
+    assert [method for method, _ in o.sent] == ["send_at_text", "send_file"]
+
+
+def test_send_file_failure_falls_back_to_chunks(tmp_path):
+    delivery = ReplyDelivery(file_threshold=500, file_dir=tmp_path)
+    o = RecordingClient(file_error=RuntimeError("发送失败"))
+    text = long_text(200)
+
+    sends = asyncio.run(
+        delivery.deliver(RecordingConsumer(), o, "1@chatroom", "a", text)
+    )
+
+    assert sends == len(o.sent) > 2
+    assert o.sent[0][0] == "send_at_text"
+    assert all(method == "send_text" for method, _ in o.sent[1:])
+    head = o.sent[0][1].split("\n...\n")[0]
+    assert head + "".join(text for _, text in o.sent[1:]) == text
+
+
+def test_chatters_share_delivery():
+    assert bot.chatter.delivery is bot.private_chatter.delivery is bot.reply_delivery
@@ -0,0 +1,76 @@
+import gc
+import signal
+from collections import defaultdict
+
+import pytest
+
+from wechatbot.os_signals import Signal
+
+
+@pytest.fixture(autouse=True)
+def signal_handlers(monkeypatch):
+    monkeypatch.setattr(Signal, "_signal_handlers", defaultdict(dict))
+    monkeypatch.setattr(Signal, "signalled", True)
+
+
+class Unhashable:
+    __hash__ = None
+
+    def __init__(self):
+        self.calls = 0
+
+    def close(self):
+        self.calls += 1
+
+
+class NoWeakref:
+    __slots__ = ("calls",)
+
+    def __init__(self):
+        self.calls = 0
+
+    def close(self):
+        self.calls += 1
+
+
+def test_register_unhashable_method():
+    obj = Unhashable()
+    Signal.register(signal.SIGTERM, obj.close)
+    Signal.register(signal.SIGTERM, obj.close)
+    assert Signal.handler_count(signal.SIGTERM) == 1
+
+    Signal._handle(signal.SIGTERM)
+    assert obj.calls == 1
+
+    Signal.unregister(signal.SIGTERM, obj.close)
+    assert Signal.handler_count() == 0
+
+
+def test_method_removed_after_object_collected():
+    obj = Unhashable()
+    Signal.register_shutdown(obj.close)
+    assert Signal.handler_count() == 2
+
+    del obj
+    gc.collect()
+    assert Signal.handler_count() == 0
+
+
+def test_method_without_weakref_kept():
+    obj = NoWeakref()
+    Signal.register(signal.SIGINT, obj.close)
+
+    Signal._handle(signal.SIGINT)
+    assert obj.calls == 1
+    assert Signal.handler_count(signal.SIGINT) == 1
+
+
+def test_register_function():
+    calls = []
+
+    def close():
+        calls.append(1)
+
+    Signal.register(signal.SIGINT, close)
+    Signal._handle(signal.SIGINT)
+    assert calls == [1]
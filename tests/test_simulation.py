@@ -0,0 +1,93 @@
+import json
+
+from main import main
+from wechatbot.settings import settings
+from wechatbot.simulation import (
+    LinkProfile,
+    ScriptedFrame,
+    SimulatedChatGPT,
+    SimulatedWechat,
+    TrafficProfile,
+    default_self_wxid,
+    make_message,
+    simulate,
+)
+
+
+def test_simulation_is_repeatable():
+    def run():
+        traffic = TrafficProfile.chatroom_traffic(seed=3, duration=20)
+        link = LinkProfile(latency=0.05, jitter=0.05, fault_rate=0.02)
+        return simulate(main, traffic, seed=3, link=link)
+
+    first = run()
+    assert first["received"] > 0
+    assert first["sent"] > 0
+    assert first["faults"] > 0
+    assert run() == first
+
+
+def test_revokes_query_without_at(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "ADMIN_WXIDS", ["wxid_admin"])
+    frames = [
+        {
+            "at": 0.1,
+            "message": {
+                "sender": "1@chatroom",
+                "wxid": "wxid_a",
+                "message": "秘密",
+                "msgid": 1,
+            },
+        },
+        {
+            "at": 0.2,
+            "message": {
+                "sender": "1@chatroom",
+                "wxid": "wxid_a",
+                "type": 10002,
+                "message": "<sysmsg><revokemsg><newmsgid>1</newmsgid></revokemsg></sysmsg>",
+            },
+        },
+        {
+            "at": 0.5,
+            "message": {
+                "sender": "1@chatroom",
+                "wxid": "wxid_admin",
+                "message": "/revokes today",
+            },
+        },
+        {"at": 0.6, "message": {"sender": "wxid_b", "wxid": "wxid_b", "message": "你好"}},
+    ]
+    profile = tmp_path.joinpath("profile.jsonl")
+    profile.write_text(
+        "\n".join(json.dumps(frame, ensure_ascii=False) for frame in frames),
+        encoding="utf-8",
+    )
+    wechat = SimulatedWechat(link=LinkProfile(latency=0.01))
+
+    simulate(main, str(profile), wechat=wechat)
+
+    sent = {(record.method, record.wxid): record.payload for record in wechat.sent}
+    assert sent[("send_text", settings.WECHAT_REVOKE_FORWARD_TO)] == "秘密"
+    # 撤回时间使用虚拟时钟，每次运行都一样
+    assert (
+        sent[("send_text", "wxid_admin")]
+        == "2023-06-01 撤回记录(1):\n[08:00:00] wxid_a「文字」秘密"
+    )
+    assert ("send_text", "wxid_b") in sent
+
+
+def test_long_reply_uses_fewer_sends():
+    message = make_message(
+        "1@chatroom", "wxid_a", "@bot\u2005讲讲", at_user_list=[default_self_wxid]
+    )
+    traffic = TrafficProfile([ScriptedFrame(at=0.1, message=message)])
+    wechat = SimulatedWechat(link=LinkProfile(latency=0.05))
+    chatgpt = SimulatedChatGPT(reply_length=3000)
+
+    simulate(main, traffic, wechat=wechat, chatgpt=chatgpt)
+
+    replies = [r for r in wechat.sent if r.method in ("send_at_text", "send_text")]
+    assert sum(len(r.payload) for r in replies) >= 3000
+    # 按固定300字符切分需要11次发送
+    assert 1 < len(replies) < 10
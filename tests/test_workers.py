@@ -0,0 +1,163 @@
+import asyncio
+import json
+from collections import defaultdict
+
+import pytest
+
+from wechatbot import bot
+from wechatbot.simulation import SimulatedRedis, VirtualClockEventLoop, make_message
+from wechatbot.workers import (
+    HashRing,
+    Ingress,
+    OutboundRPCClient,
+    consume_partition,
+    create_group,
+    group_name,
+    ingress_stream,
+    outbound_latency_key,
+    outbound_stream,
+)
+
+
+def run(coro):
+    loop = VirtualClockEventLoop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+async def stop_tasks():
+    """模拟进程退出: 取消所有任务，不执行任何清理"""
+    tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def raw_message(chatroom_id: str, seq: int) -> bytes:
+    message = make_message(chatroom_id, "wxid_a", str(seq), msgid=seq)
+    return json.dumps(message, ensure_ascii=False).encode("utf-8")
+
+
+class RecordingClient:
+    def __init__(self, latency: float = 0.1):
+        self.latency = latency
+        self.sent = []
+
+    async def send_text(self, wxid, text):
+        await asyncio.sleep(self.latency)
+        self.sent.append((wxid, text))
+
+
+@pytest.fixture
+def ingress():
+    ingress = Ingress(3)
+    ingress.redis_client = SimulatedRedis()
+    return ingress
+
+
+def test_hash_ring_moves_few_keys():
+    keys = [f"{i}@chatroom" for i in range(1000)]
+    before = HashRing(list(range(3)))
+    after = HashRing(list(range(4)))
+
+    assert {before.get(key) for key in keys} == {0, 1, 2}
+    moved = [key for key in keys if before.get(key) != after.get(key)]
+    assert all(after.get(key) == 3 for key in moved)
+    assert len(moved) < len(keys) / 2
+
+
+def test_partition_by_sender(ingress):
+    for i in range(20):
+        chatroom_id = f"{i}@chatroom"
+        partition = ingress.ring.get(chatroom_id)
+        assert ingress.partition(raw_message(chatroom_id, 1)) == partition
+        assert ingress.partition(raw_message(chatroom_id, 2).decode()) == partition
+
+
+def test_chatroom_order_through_workers(ingress, monkeypatch):
+    redis_client = ingress.redis_client
+    handled = defaultdict(list)
+
+    async def on_message(raw, o):
+        message = json.loads(raw)
+        handled[message["sender"]].append((id(o), int(message["message"])))
+        await o.send_text(message["sender"], message["message"])
+
+    monkeypatch.setattr(bot, "_on_message", on_message)
+    chatroom_ids = [f"{i}@chatroom" for i in range(6)]
+    o = RecordingClient()
+
+    async def main():
+        await create_group(redis_client, outbound_stream)
+        for partition in range(ingress.workers):
+            await create_group(redis_client, ingress_stream(partition))
+        for worker_id in range(ingress.workers):
+            asyncio.create_task(consume_partition(worker_id, redis_client))
+        asyncio.create_task(ingress.relay_outbound(o))
+        for seq in range(10):
+            for chatroom_id in chatroom_ids:
+                await ingress.push(raw_message(chatroom_id, seq))
+            await asyncio.sleep(0.05)
+        await asyncio.sleep(30)
+        await stop_tasks()
+
+    run(main())
+
+    for chatroom_id in chatroom_ids:
+        workers = {worker for worker, _ in handled[chatroom_id]}
+        assert len(workers) == 1
+        assert [seq for _, seq in handled[chatroom_id]] == list(range(10))
+        sent = [int(text) for wxid, text in o.sent if wxid == chatroom_id]
+        assert sent == list(range(10))
+    assert float(run(redis_client.get(outbound_latency_key))) == pytest.approx(0.1)
+    for partition in range(ingress.workers):
+        assert run(redis_client.xlen(ingress_stream(partition))) == 0
+    assert run(redis_client.xlen(outbound_stream)) == 0
+
+
+def test_unfinished_frame_redelivered_after_crash(monkeypatch):
+    redis_client = SimulatedRedis()
+    stream = ingress_stream(0)
+    handled = []
+
+    async def hang(raw, o):
+        await asyncio.Event().wait()
+
+    async def record(raw, o):
+        handled.append(json.loads(raw)["message"])
+
+    async def crash():
+        await create_group(redis_client, stream)
+        asyncio.create_task(consume_partition(0, redis_client))
+        await redis_client.xadd(stream, {"raw": raw_message("1@chatroom", 1)})
+        await asyncio.sleep(1)
+        await stop_tasks()
+        # worker退出期间写入的消息
+        await redis_client.xadd(stream, {"raw": raw_message("1@chatroom", 2)})
+
+    async def restart():
+        await create_group(redis_client, stream)
+        asyncio.create_task(consume_partition(0, redis_client))
+        await asyncio.sleep(1)
+        await stop_tasks()
+
+    monkeypatch.setattr(bot, "_on_message", hang)
+    run(crash())
+    assert run(redis_client.xpending(stream, group_name))["pending"] == 1
+
+    monkeypatch.setattr(bot, "_on_message", record)
+    run(restart())
+    assert handled == ["1", "2"]
+    assert run(redis_client.xpending(stream, group_name))["pending"] == 0
+    assert run(redis_client.xlen(stream)) == 0
+
+
+def test_outbound_client_uses_relay_latency():
+    redis_client = SimulatedRedis()
+    o = OutboundRPCClient(redis_client)
+
+    assert run(o.get_send_latency()) is None
+    run(redis_client.set(outbound_latency_key, 0.5))
+    assert run(o.get_send_latency()) == 0.5
@@ -5,17 +5,19 @@ import logging
 import os.path
 import random
 import re
-import time
-from collections import defaultdict
-from datetime import datetime
-from typing import Dict, List
+from datetime import date, datetime, timedelta
+from typing import Callable, List, Set
 
 import requests.exceptions
 from redis import asyncio as aredis
 from whochat.messages.constants import WechatMsgType
 from whochat.rpc.clients.websocket import OneBotWebsocketRPCClient
 
-from wechatbot.chatgpt import ChatGPTFactory
+from wechatbot.chatgpt import ChatGPT, ChatGPTFactory
+from wechatbot.delivery import ReplyDelivery, find_cut
+from wechatbot.memory import format_bytes, get_rss
+from wechatbot.os_signals import Signal
+from wechatbot.revoke_archive import RevokeArchive, unknown_type
 from wechatbot.settings import settings
 
 redis_client = aredis.Redis(
@@ -25,11 +27,20 @@ redis_client = aredis.Redis(
     db=2,
 )
 
+revoke_archive = RevokeArchive(
+    settings.REVOKE_ARCHIVE_DIR, settings.REVOKE_ARCHIVE_RETENTION_DAYS
+)
+Signal.register_shutdown(revoke_archive.close)
+
 wechat_revoke_time = 121
 wechat_message_store_ex = 1200
+reply_more_ex = 600
 
 global_context = {}
 
+# 撤回归档使用的当前时间，模拟模式下替换为虚拟时钟
+clock: Callable[[], datetime] = datetime.now
+
 logger = logging.getLogger("wechatbot")
 
 
@@ -164,7 +175,7 @@ class RevokeBlocker(MessageConsumer):
         if self.wxids != WxID.ALL and sender not in self.wxids:
             return
 
-        now = datetime.now()
+        now = clock()
         if message["type"] in (
             WechatMsgType.图片,
             WechatMsgType.语音,
@@ -186,17 +197,109 @@ class RevokeBlocker(MessageConsumer):
             revoked_msg_str = await redis_client.get(str(revoked_msgid))
             if not revoked_msg_str:
                 return
-            await redis_client.hset(
-                f"revoke:{now.date()}:{message['wxid']}",
-                str(revoked_msgid),
-                revoked_msg_str,
-            )
             try:
                 revoked_msg = json.loads(revoked_msg_str)
-                await self.forward(o, message, revoked_msg)
-
             except json.JSONDecodeError:
+                revoked_msg = None
+            await revoke_archive.async_add(
+                revoked_msgid,
+                message["wxid"],
+                sender,
+                int(revoked_msg["type"]) if revoked_msg else unknown_type,
+                revoked_msg_str,
+                revoked_at=now,
+            )
+            if revoked_msg is None:
                 logger.info(f"撤回内容为：{revoked_msg_str}")
+                return
+            await self.forward(o, message, revoked_msg)
+
+
+class RevokeQuerier(MessageConsumer):
+    """
+    管理员在群里查询撤回归档，结果私聊发送给管理员:
+    /revokes [@用户] [today|yesterday|2023-06-01] [消息类型]
+    """
+
+    command = "/revokes"
+    max_records = 20
+    max_content_length = 100
+
+    def parse_date(self, word: str) -> date | None:
+        today = clock().date()
+        if word == "today":
+            return today
+        if word == "yesterday":
+            return today - timedelta(days=1)
+        try:
+            return date.fromisoformat(word)
+        except ValueError:
+            return None
+
+    def format_record(self, record) -> str:
+        revoked_msg = record["message"]
+        try:
+            type_name = WechatMsgType(record["type"]).name
+        except ValueError:
+            type_name = "未知"
+        content = ""
+        if isinstance(revoked_msg, str):
+            content = revoked_msg
+        elif isinstance(revoked_msg, dict):
+            if record["type"] == WechatMsgType.文字:
+                content = revoked_msg["message"]
+            else:
+                content = revoked_msg.get("filepath") or revoked_msg.get(
+                    "thumb_path", ""
+                )
+        if len(content) > self.max_content_length:
+            content = content[: self.max_content_length] + "..."
+        return (
+            f"[{record['revoked_at']:%H:%M:%S}] {record['wxid']}「{type_name}」{content}"
+        )
+
+    async def query(self, o, message: dict, words: List[str]):
+        admin_wxid = message["wxid"]
+        query_date = clock().date()
+        type_ = None
+        for word in words:
+            if parsed := self.parse_date(word):
+                query_date = parsed
+            elif word in WechatMsgType.__members__:
+                type_ = WechatMsgType[word]
+            else:
+                return await self.send_text(o, admin_wxid, f"无法识别的参数: {word}")
+
+        at_user_list = (message["extrainfo"] or {}).get("at_user_list") or [None]
+        records = []
+        for wxid in at_user_list:
+            records.extend(
+                await revoke_archive.async_query(
+                    query_date,
+                    wxid=wxid,
+                    chatroom_id=message["sender"],
+                    type_=type_,
+                    limit=self.max_records,
+                )
+            )
+        records.sort(key=lambda record: record["revoked_at"], reverse=True)
+        lines = [self.format_record(record) for record in records[: self.max_records]]
+        if not lines:
+            return await self.send_text(o, admin_wxid, f"{query_date} 没有撤回记录")
+        await self.send_text(
+            o, admin_wxid, f"{query_date} 撤回记录({len(lines)}):\n" + "\n".join(lines)
+        )
+
+    async def consume(self, o: OneBotWebsocketRPCClient, message: dict):
+        if message["type"] != WechatMsgType.文字 or not self.from_room(message):
+            return
+        # 微信的@以\u2005结尾，昵称中可能有空格
+        words = re.sub(r"@[^\u2005]*\u2005", " ", message["message"]).split()
+        if not words or words[0] != self.command:
+            return
+        if not self.from_admin(message["wxid"]):
+            return
+        await self.query(o, message, words[1:])
 
 
 class Repeater(MessageConsumer):
@@ -275,6 +378,15 @@ class Responder(MessageConsumer):
             await self.do_echo(o, message)
 
 
+# 所有回复都经过同一个RPC连接发送，Chatter和PrivateChatter共用
+reply_delivery = ReplyDelivery(
+    max_chunk_size=settings.REPLY_MAX_CHUNK_SIZE,
+    target_time=settings.REPLY_TARGET_SECONDS,
+    file_threshold=settings.REPLY_FILE_THRESHOLD,
+    file_dir=settings.REPLY_FILE_DIR,
+)
+
+
 class Chatter(MessageConsumer):
     def __init__(
         self,
@@ -282,11 +394,29 @@ class Chatter(MessageConsumer):
     ):
         super().__init__()
         self.sender_ids = sender_ids
-        self.chatgpt = ChatGPTFactory.get(pickle_file="cache/chatter.chatgpt.pickle")
-        self.sender_id_thinking: Dict[str, bool] = defaultdict(bool)
+        self.pickle_file = "cache/chatter.chatgpt.pickle"
+        if settings.WORKER_ID is not None:
+            # 每个worker只处理自己分区的群，各自保存
+            self.pickle_file = (
+                f"cache/chatter.chatgpt.worker{settings.WORKER_ID}.pickle"
+            )
+        self._chatgpt: ChatGPT | None = None
+        self.thinking_sender_ids: Set[str] = set()
+        self.delivery = reply_delivery
+
+    @property
+    def chatgpt(self) -> ChatGPT:
+        # 用到时再加载，导入bot模块时不需要cookies等ChatGPT配置
+        if self._chatgpt is None:
+            self._chatgpt = ChatGPTFactory.get(pickle_file=self.pickle_file)
+        return self._chatgpt
+
+    @chatgpt.setter
+    def chatgpt(self, chatgpt: ChatGPT):
+        self._chatgpt = chatgpt
 
     def still_thinking(self, chatroom_id):
-        return self.sender_id_thinking[chatroom_id]
+        return chatroom_id in self.thinking_sender_ids
 
     def get_pure_text(self, message):
         m = re.match(r"^@.*?(\u2005|\s)(.*)", message["message"])
@@ -299,7 +429,8 @@ class Chatter(MessageConsumer):
     async def _chat(self, o, message):
         chatroom_id = message["sender"]
         wxid = message["wxid"]
-        start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        start = loop.time()
         pure_text = self.get_pure_text(message)
 
         if not pure_text:
@@ -310,6 +441,20 @@ class Chatter(MessageConsumer):
                 return await self.send_at_text(o, chatroom_id, [wxid], "已重置😳")
             else:
                 return await self.send_at_text(o, chatroom_id, [wxid], "不熟🙅")
+        if pure_text == "/memory":
+            if self.from_admin(wxid):
+                return await self.send_at_text(o, chatroom_id, [wxid], memory_report())
+            else:
+                return await self.send_at_text(o, chatroom_id, [wxid], "不熟🙅")
+        if pure_text == "/more":
+            more_key = f"{chatroom_id}:reply:more"
+            rest = await redis_client.get(more_key)
+            if not rest:
+                return await self.send_at_text(o, chatroom_id, [wxid], "没有更多了🤷")
+            await redis_client.delete(more_key)
+            return await self.delivery.deliver(
+                self, o, chatroom_id, wxid, rest.decode("utf-8")
+            )
         max_text_length = 300
         if len(pure_text) > 300:
             return await self.send_at_text(
@@ -321,28 +466,26 @@ class Chatter(MessageConsumer):
         except requests.exceptions.ConnectionError:
             return await self.send_at_text(o, chatroom_id, [wxid], "我的网络出了点问题，请稍后试试😦")
         text = result["text"]
-        texts = []
-        for index in range(0, len(text), max_text_length):
-            _text = text[index : index + max_text_length]
-            texts.append(_text)
-        texts[-1] += f"\n...\n本次回复耗时: {int(time.perf_counter() - start)}秒👀"
-        for i, _text in enumerate(texts):
-            if i == 0:
-                await self.send_at_text(o, chatroom_id, [wxid], _text)
-            else:
-                await self.send_text(o, chatroom_id, _text)
-            await asyncio.sleep(0.1)
+        if settings.REPLY_SUMMARY_FIRST and len(text) > self.delivery.min_chunk_size:
+            # 先发送开头部分，剩余内容通过/more获取
+            cut = find_cut(text, self.delivery.min_chunk_size)
+            await redis_client.set(
+                f"{chatroom_id}:reply:more", text[cut:].lstrip(), ex=reply_more_ex
+            )
+            text = text[:cut].rstrip() + "\n...\n发送「/more」查看剩余内容"
+        text += f"\n...\n本次回复耗时: {int(loop.time() - start)}秒👀"
+        await self.delivery.deliver(self, o, chatroom_id, wxid, text)
 
     async def chat(self, o, message):
         chatroom_id = message["sender"]
         wxid = message["wxid"]
         if self.still_thinking(chatroom_id):
             return await self.send_at_text(o, chatroom_id, [wxid], "上一条还没完成呢🙏")
-        self.sender_id_thinking[chatroom_id] = True
+        self.thinking_sender_ids.add(chatroom_id)
         try:
             await self._chat(o, message)
         finally:
-            self.sender_id_thinking[chatroom_id] = False
+            self.thinking_sender_ids.discard(chatroom_id)
 
     async def consume(self, o: OneBotWebsocketRPCClient, message: dict):
         if not self.from_target_rooms(message, self.sender_ids):
@@ -388,6 +531,50 @@ responder = Responder(echo_words=["嗯？", "是吗？", "然后呢？", "？？
 repeater = Repeater(chatroom_ids=settings.REPEATER_CHATROOM_IDS)
 chatter = Chatter(sender_ids=settings.CHATTER_CHATROOM_IDS)
 private_chatter = PrivateChatter(sender_ids=settings.PRIVATE_CHATTER_SENDER_IDS)
+revoke_querier = RevokeQuerier()
+
+
+async def migrate_revoke_hashes():
+    """把旧版本写入Redis的revoke:{date}:{wxid}(没有过期时间)迁移到撤回归档并删除"""
+    earliest = clock().date() - timedelta(days=revoke_archive.retention_days)
+    async for key in redis_client.scan_iter(match="revoke:*", _type="HASH"):
+        try:
+            _, date_str, wxid = key.decode("utf-8").split(":", 2)
+            revoked_date = date.fromisoformat(date_str)
+        except ValueError:
+            logger.warning(f"无法识别的撤回记录，跳过: {key}")
+            continue
+        if revoked_date >= earliest:
+            revoked_at = datetime.combine(revoked_date, datetime.min.time())
+            for msgid, revoked_msg_str in (await redis_client.hgetall(key)).items():
+                try:
+                    revoked_msg = json.loads(revoked_msg_str)
+                except json.JSONDecodeError:
+                    revoked_msg = None
+                await revoke_archive.async_add(
+                    int(msgid),
+                    wxid,
+                    revoked_msg.get("sender", "") if revoked_msg else "",
+                    int(revoked_msg["type"]) if revoked_msg else unknown_type,
+                    revoked_msg_str,
+                    revoked_at=revoked_at,
+                )
+        await redis_client.delete(key)
+        logger.info(f"已迁移撤回记录: {key}")
+
+
+def memory_report() -> str:
+    chatgpt = chatter.chatgpt
+    sizes = {
+        "常驻内存": format_bytes(get_rss()),
+        "Chatroom(内存)": f"{len(chatgpt.chatrooms)}/{chatgpt.max_chatrooms}",
+        "Chatroom(磁盘)": len(chatgpt.chatroom_store),
+        "思考中": len(chatter.thinking_sender_ids)
+        + len(private_chatter.thinking_sender_ids),
+        "信号处理程序": Signal.handler_count(),
+        "撤回归档分区": revoke_archive.open_partition_count(),
+    }
+    return "\n".join(f"{name}: {size}" for name, size in sizes.items())
 
 
 async def _on_message(raw_message: str | bytes, o: OneBotWebsocketRPCClient):
@@ -403,6 +590,7 @@ async def _on_message(raw_message: str | bytes, o: OneBotWebsocketRPCClient):
         repeater.consume_robust(o, message),
         chatter.consume_robust(o, message),
         private_chatter.consume_robust(o, message),
+        revoke_querier.consume_robust(o, message),
     )
 
 
@@ -6,7 +6,11 @@ import json
 import logging
 import os
 import pickle
-from typing import Dict, TypedDict
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import List, TypedDict
 
 import requests
 from requests.cookies import RequestsCookieJar
@@ -26,6 +30,12 @@ default_timeout = 60 * 5
 
 cached_chatgpt_pickle_file = "cache/chatgpt.pickle"
 
+# 内存中最多保留的Chatroom数量，超出的按LRU写入磁盘，用到时再加载
+default_max_chatrooms = 1000
+
+# 换出到磁盘的Chatroom超过该时间(秒)未使用则删除
+default_chatroom_store_ttl = 30 * 24 * 60 * 60
+
 logger = logging.getLogger("wechatbot")
 
 
@@ -63,13 +73,77 @@ class auto:  # noqa
     pass
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class Chatroom:
     id: str
     current_message_id: int = None
     current_message: str = None
     initial_prompt: str = None
 
+    def __getstate__(self):
+        return dataclasses.asdict(self)
+
+    def __setstate__(self, state):
+        # 兼容没有__slots__时pickle的Chatroom
+        for name, value in state.items():
+            setattr(self, name, value)
+
+
+class ChatroomStore:
+    """换出内存的Chatroom，保存在SQLite中，连接一直保持打开直到close"""
+
+    def __init__(self, file: str, ttl: int = default_chatroom_store_ttl):
+        self.file = file
+        self.ttl = ttl
+        self._conn: sqlite3.Connection | None = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.file, check_same_thread=False)
+            # 删除的记录直接释放空间，文件大小不会只增不减
+            conn.execute("PRAGMA auto_vacuum = FULL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS chatrooms "
+                "(id TEXT PRIMARY KEY, updated_at REAL NOT NULL, data BLOB NOT NULL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_chatrooms_updated_at "
+                "ON chatrooms (updated_at)"
+            )
+            self._conn = conn
+        return self._conn
+
+    def put_many(self, chatrooms: List[Chatroom]):
+        conn = self._connect()
+        now = time.time()
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO chatrooms VALUES (?, ?, ?)",
+                [(chatroom.id, now, pickle.dumps(chatroom)) for chatroom in chatrooms],
+            )
+            conn.execute(
+                "DELETE FROM chatrooms WHERE updated_at < ?", (now - self.ttl,)
+            )
+
+    def pop(self, chatroom_id) -> Chatroom | None:
+        conn = self._connect()
+        with conn:
+            row = conn.execute(
+                "SELECT data FROM chatrooms WHERE id = ?", (chatroom_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute("DELETE FROM chatrooms WHERE id = ?", (chatroom_id,))
+        return pickle.loads(row[0])
+
+    def __len__(self):
+        return self._connect().execute("SELECT COUNT(*) FROM chatrooms").fetchone()[0]
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
 
 class CaredResult(TypedDict):
     text: str
@@ -83,12 +157,16 @@ class ChatGPT:
         timeout: int = default_timeout,
         *,
         pickle_file: str = None,
+        max_chatrooms: int = default_max_chatrooms,
     ):
         self.chat_url = chat_url
         self.session = session or get_session()
         self.timeout = timeout
         self.pickle_file = pickle_file
-        self.chatrooms: Dict[int, "Chatroom"] = {}
+        self.max_chatrooms = max_chatrooms
+        self.chatrooms: OrderedDict[str, "Chatroom"] = OrderedDict()
+        self._chatrooms_lock = threading.RLock()
+        self._chatroom_store: ChatroomStore | None = None
         if pickle_file and os.path.exists(pickle_file):
             other = ChatGPT.load(pickle_file)
             self.clone(other)
@@ -103,14 +181,51 @@ class ChatGPT:
         """实现你自己的聊天方法"""
         raise NotImplementedError
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop("_chatrooms_lock", None)
+        state.pop("_chatroom_store", None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._chatrooms_lock = threading.RLock()
+        self._chatroom_store = None
+
+    @property
+    def chatroom_store(self) -> ChatroomStore:
+        if self._chatroom_store is None:
+            self._chatroom_store = ChatroomStore(
+                (self.pickle_file or cached_chatgpt_pickle_file) + ".chatrooms.sqlite3"
+            )
+        return self._chatroom_store
+
+    def _put_chatroom(self, chatroom: Chatroom):
+        self.chatrooms[chatroom.id] = chatroom
+        self.chatrooms.move_to_end(chatroom.id)
+        evicted = []
+        while len(self.chatrooms) > self.max_chatrooms:
+            evicted.append(self.chatrooms.popitem(last=False)[1])
+        if evicted:
+            self.chatroom_store.put_many(evicted)
+
+    def get_chatroom(self, chatroom_id) -> Chatroom:
+        with self._chatrooms_lock:
+            if chatroom_id in self.chatrooms:
+                self.chatrooms.move_to_end(chatroom_id)
+                return self.chatrooms[chatroom_id]
+            chatroom = self.chatroom_store.pop(chatroom_id) or Chatroom(id=chatroom_id)
+            self._put_chatroom(chatroom)
+            return chatroom
+
     def update_chatroom(self, chatroom_id, result):
-        chatroom = self.chatrooms[chatroom_id]
+        chatroom = self.get_chatroom(chatroom_id)
         chatroom.current_message_id = result["id"]
         chatroom.current_message = result["text"]
 
     def reset_chatroom(self, chatroom_id):
-        chatroom = Chatroom(id=chatroom_id)
-        self.chatrooms[chatroom_id] = chatroom
+        with self._chatrooms_lock:
+            self._put_chatroom(Chatroom(id=chatroom_id))
 
     def new_chat(self, chatroom_id, prompt: str):
         return self.chat(chatroom_id, prompt, parent_message_id=None)
@@ -118,11 +233,7 @@ class ChatGPT:
     def chat(
         self, chatroom_id, prompt: str, parent_message_id: str | None = auto
     ) -> CaredResult:
-        if chatroom_id not in self.chatrooms:
-            chatroom = Chatroom(id=chatroom_id)
-            self.chatrooms[chatroom_id] = chatroom
-        else:
-            chatroom = self.chatrooms[chatroom_id]
+        chatroom = self.get_chatroom(chatroom_id)
         if parent_message_id is auto:
             parent_message_id = chatroom.current_message_id
 
@@ -164,11 +275,16 @@ class ChatGPT:
     def close(self):
         self.save()
         self.save_session(cached_session_file)
+        with self._chatrooms_lock:
+            self.chatroom_store.close()
         return True
 
     def clone(self, chatgpt: "ChatGPT"):
         self.session = chatgpt.session
-        self.chatrooms = chatgpt.chatrooms
+        with self._chatrooms_lock:
+            self.chatrooms = OrderedDict()
+            for chatroom in chatgpt.chatrooms.values():
+                self._put_chatroom(chatroom)
 
 
 class ChatGPTFactory:
@@ -0,0 +1,150 @@
+import asyncio
+import logging
+import math
+import pathlib
+import re
+import time
+from typing import List
+
+logger = logging.getLogger("wechatbot")
+
+# 还没有观测到发送耗时时使用的初始值(秒)
+default_send_latency = 0.2
+
+# 优先在段落、换行、句末、逗号处切分
+boundary_patterns = [
+    re.compile(r"\n\s*\n"),
+    re.compile(r"\n"),
+    re.compile(r"[。！？!?；;]|\.\s"),
+    re.compile(r"[，,、]|\s"),
+]
+
+
+def find_cut(text: str, max_length: int) -> int:
+    """text[:max_length]中最合适的切分位置"""
+    window = text[:max_length]
+    for pattern in boundary_patterns:
+        ends = [m.end() for m in pattern.finditer(window)]
+        # 切分点太靠前会产生很多碎片，放弃这一级边界
+        if ends and ends[-1] > max_length * 3 // 4:
+            return ends[-1]
+    return max_length
+
+
+def split_text(text: str, max_length: int) -> List[str]:
+    """按语义边界切分文本，每段不超过max_length"""
+    chunks = []
+    while len(text) > max_length:
+        cut = find_cut(text, max_length)
+        chunks.append(text[:cut].rstrip())
+        text = text[cut:].lstrip()
+    if text:
+        chunks.append(text)
+    return chunks
+
+
+class ReplyDelivery:
+    """
+    长回复的发送策略: 根据观测到的发送耗时调整分段长度，使整体发送时间不超过target_time，
+    超过file_threshold个字符时写入文件，作为一个文件发送
+
+    所有发送都经过同一个微信RPC连接，发送耗时与对象无关，bot中的Chatter和PrivateChatter共用一个实例；
+    如果o提供get_send_latency(如多进程模式下的OutboundRPCClient，调用只是写入队列)，
+    则使用它报告的真实发送耗时，不再自己计时
+
+    发送文件失败时剩余内容改为分段发送；多进程模式下发送在主进程执行，失败时无法回退
+    """
+
+    def __init__(
+        self,
+        min_chunk_size: int = 300,
+        max_chunk_size: int = 2000,
+        interval: float = 0.1,
+        target_time: float = 2.0,
+        file_threshold: int = 3000,
+        file_dir: str | pathlib.Path = None,
+        file_max_age: int = 24 * 60 * 60,
+    ):
+        self.min_chunk_size = min_chunk_size
+        self.max_chunk_size = max_chunk_size
+        self.interval = interval
+        self.target_time = target_time
+        self.file_threshold = file_threshold
+        self.file_dir = pathlib.Path(file_dir) if file_dir else None
+        self.file_max_age = file_max_age
+        # 单次发送耗时的指数移动平均
+        self.send_latency = default_send_latency
+
+    def observe(self, latency: float):
+        self.send_latency = 0.8 * self.send_latency + 0.2 * latency
+
+    def chunk_size(self, text_length: int) -> int:
+        max_sends = max(int(self.target_time / (self.send_latency + self.interval)), 1)
+        size = math.ceil(text_length / max_sends)
+        return min(max(size, self.min_chunk_size), self.max_chunk_size)
+
+    def split(self, text: str) -> List[str]:
+        return split_text(text, self.chunk_size(len(text)))
+
+    def write_file(self, chatroom_id: str, text: str) -> pathlib.Path:
+        self.file_dir.mkdir(parents=True, exist_ok=True)
+        now = time.time()
+        for file in self.file_dir.glob("reply-*.txt"):
+            if now - file.stat().st_mtime > self.file_max_age:
+                file.unlink(missing_ok=True)
+        file = self.file_dir.joinpath(f"reply-{chatroom_id}-{int(now * 1000)}.txt")
+        file.write_text(text, encoding="utf-8")
+        return file.absolute()
+
+    async def _timed(self, coro, timed=True):
+        if not timed:
+            return await coro
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        result = await coro
+        self.observe(loop.time() - start)
+        return result
+
+    async def deliver(self, consumer, o, chatroom_id: str, wxid: str, text: str):
+        """发送text，第一条@wxid，返回发送次数"""
+        get_send_latency = getattr(o, "get_send_latency", None)
+        timed = get_send_latency is None
+        if not timed:
+            self.send_latency = await get_send_latency() or self.send_latency
+        if self.file_dir and len(text) > self.file_threshold:
+            file = self.write_file(chatroom_id, text)
+            cut = find_cut(text, self.min_chunk_size)
+            head = text[:cut].rstrip()
+            await self._timed(
+                consumer.send_at_text(
+                    o, chatroom_id, [wxid], f"{head}\n...\n回复较长，全文见文件📄"
+                ),
+                timed,
+            )
+            try:
+                await self._timed(o.send_file(chatroom_id, str(file)), timed)
+                return 2
+            except Exception as e:
+                logger.error(f"发送文件失败，剩余内容改为分段发送: {file}")
+                logger.exception(e)
+            return 1 + await self.send_chunks(
+                consumer, o, chatroom_id, None, text[cut:].lstrip(), timed
+            )
+        return await self.send_chunks(consumer, o, chatroom_id, wxid, text, timed)
+
+    async def send_chunks(
+        self, consumer, o, chatroom_id: str, wxid: str | None, text: str, timed=True
+    ):
+        """分段发送text，wxid不为None时第一条@wxid，返回发送次数"""
+        texts = self.split(text)
+        for i, _text in enumerate(texts):
+            if i > 0:
+                await asyncio.sleep(self.interval)
+            if i == 0 and wxid is not None:
+                await self._timed(
+                    consumer.send_at_text(o, chatroom_id, [wxid], _text), timed
+                )
+            else:
+                await self._timed(consumer.send_text(o, chatroom_id, _text), timed)
+        logger.debug(f"回复{len(text)}个字符，分{len(texts)}次发送")
+        return len(texts)
@@ -0,0 +1,27 @@
+import os
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+def get_rss() -> int | None:
+    """当前进程的常驻内存(字节)，无法获取时返回None"""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open("/proc/self/statm", "r") as fp:
+            return int(fp.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def format_bytes(size: int | None) -> str:
+    if size is None:
+        return "未知"
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.1f}GB"
@@ -1,14 +1,30 @@
+import functools
+import inspect
 import signal
 import sys
 import time
+import weakref
 from collections import defaultdict
-from typing import Callable, Dict, Set
+from typing import Callable, Dict, Hashable
 
 from .logger import logger
 
 
+class _StrongRef:
+    """与weakref.WeakMethod接口一致的强引用"""
+
+    __slots__ = ("func",)
+
+    def __init__(self, func):
+        self.func = func
+
+    def __call__(self):
+        return self.func
+
+
 class Signal:
-    _signal_handlers: Dict[int, Set[Callable]] = defaultdict(set)
+    # 按id保存处理程序，不要求对象可哈希；绑定方法以弱引用保存，对象被回收后自动移除
+    _signal_handlers: Dict[int, Dict[Hashable, Callable]] = defaultdict(dict)
     signalled: bool = False
     signal_count: Dict[int, int] = defaultdict(int)
 
@@ -17,7 +33,31 @@ class Signal:
         if not cls.signalled:
             cls.signal()
         assert callable(func)
-        cls._signal_handlers[signum].add(func)
+        key = cls._key(func)
+        cls._signal_handlers[signum][key] = cls._ref(signum, key, func)
+
+    @staticmethod
+    def _key(func) -> Hashable:
+        if inspect.ismethod(func):
+            return id(func.__self__), func.__func__
+        return id(func)
+
+    @classmethod
+    def _ref(cls, signum, key, func):
+        if inspect.ismethod(func):
+            try:
+                return weakref.WeakMethod(
+                    func, functools.partial(cls._discard_ref, signum, key)
+                )
+            except TypeError:
+                # 对象不支持弱引用
+                pass
+        return _StrongRef(func)
+
+    @classmethod
+    def _discard_ref(cls, signum, key, ref):
+        if cls._signal_handlers[signum].get(key) is ref:
+            del cls._signal_handlers[signum][key]
 
     @classmethod
     def register_sigint(cls, func):
@@ -36,11 +76,21 @@ class Signal:
 
     @classmethod
     def unregister(cls, signum, func):
-        cls._signal_handlers[signum].remove(func)
+        del cls._signal_handlers[signum][cls._key(func)]
+
+    @classmethod
+    def handler_count(cls, signum=None) -> int:
+        """已注册的处理程序数量，不指定signum时统计所有信号"""
+        if signum is not None:
+            return len(cls._signal_handlers[signum])
+        return sum(len(handlers) for handlers in cls._signal_handlers.values())
 
     @classmethod
     def _handle(cls, signum):
-        for _handler in cls._signal_handlers[signum]:
+        for ref in list(cls._signal_handlers[signum].values()):
+            _handler = ref()
+            if _handler is None:
+                continue
             try:
                 _handler()
             except Exception as e:
@@ -0,0 +1,194 @@
+import asyncio
+import contextvars
+import datetime
+import functools
+import json
+import logging
+import pathlib
+import sqlite3
+import threading
+import zlib
+from typing import Dict, List, TypedDict
+
+logger = logging.getLogger("wechatbot")
+
+default_retention_days = 30
+
+# 撤回内容无法解析时使用的消息类型
+unknown_type = 0
+
+schema = """
+CREATE TABLE IF NOT EXISTS revokes (
+    msgid INTEGER PRIMARY KEY,
+    revoked_at REAL NOT NULL,
+    wxid TEXT NOT NULL,
+    chatroom_id TEXT NOT NULL,
+    type INTEGER NOT NULL,
+    payload BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_revokes_wxid ON revokes (wxid, revoked_at);
+CREATE INDEX IF NOT EXISTS idx_revokes_chatroom_id ON revokes (chatroom_id, revoked_at);
+CREATE INDEX IF NOT EXISTS idx_revokes_type ON revokes (type, revoked_at);
+"""
+
+
+class RevokeRecord(TypedDict):
+    msgid: int
+    revoked_at: datetime.datetime
+    wxid: str
+    chatroom_id: str
+    type: int
+    message: dict | str
+
+
+class RevokeArchive:
+    """
+    按天分区的撤回消息归档，每天一个SQLite文件，消息内容使用zlib压缩，
+    按wxid、群和消息类型建立索引，超过保留天数的分区文件会被删除
+    """
+
+    def __init__(
+        self,
+        directory: str | pathlib.Path,
+        retention_days: int = default_retention_days,
+    ):
+        self.directory = pathlib.Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.retention_days = retention_days
+        self._connections: Dict[datetime.date, sqlite3.Connection] = {}
+        self._lock = threading.Lock()
+        self._last_purge_date: datetime.date | None = None
+
+    def partition_file(self, date: datetime.date) -> pathlib.Path:
+        return self.directory.joinpath(f"revoke-{date.isoformat()}.sqlite3")
+
+    def _connect(self, date: datetime.date, create=False) -> sqlite3.Connection | None:
+        if date in self._connections:
+            return self._connections[date]
+        file = self.partition_file(date)
+        if not create and not file.exists():
+            return None
+        conn = sqlite3.connect(file, check_same_thread=False)
+        conn.executescript(schema)
+        self._connections[date] = conn
+        return conn
+
+    def open_partition_count(self) -> int:
+        """当前打开的分区连接数"""
+        return len(self._connections)
+
+    def purge(self, today: datetime.date = None):
+        """删除超出保留天数的分区"""
+        today = today or datetime.date.today()
+        earliest = today - datetime.timedelta(days=self.retention_days)
+        for file in self.directory.glob("revoke-*.sqlite3"):
+            try:
+                date = datetime.date.fromisoformat(file.stem[len("revoke-") :])
+            except ValueError:
+                continue
+            if date >= earliest:
+                continue
+            conn = self._connections.pop(date, None)
+            if conn:
+                conn.close()
+            file.unlink(missing_ok=True)
+            logger.info(f"撤回归档分区已过期，删除: {file}")
+        self._last_purge_date = today
+
+    def add(
+        self,
+        msgid: int,
+        wxid: str,
+        chatroom_id: str,
+        type_: int,
+        raw_message: str | bytes,
+        revoked_at: datetime.datetime = None,
+    ):
+        revoked_at = revoked_at or datetime.datetime.now()
+        if isinstance(raw_message, str):
+            raw_message = raw_message.encode("utf-8")
+        with self._lock:
+            if self._last_purge_date != revoked_at.date():
+                self.purge(revoked_at.date())
+            conn = self._connect(revoked_at.date(), create=True)
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO revokes VALUES (?, ?, ?, ?, ?, ?)",
+                    (
+                        msgid,
+                        revoked_at.timestamp(),
+                        wxid,
+                        chatroom_id,
+                        type_,
+                        zlib.compress(raw_message),
+                    ),
+                )
+
+    def query(
+        self,
+        date: datetime.date,
+        *,
+        wxid: str = None,
+        chatroom_id: str = None,
+        type_: int = None,
+        limit: int = 20,
+    ) -> List[RevokeRecord]:
+        conditions, params = [], []
+        if wxid is not None:
+            conditions.append("wxid = ?")
+            params.append(wxid)
+        if chatroom_id is not None:
+            conditions.append("chatroom_id = ?")
+            params.append(chatroom_id)
+        if type_ is not None:
+            conditions.append("type = ?")
+            params.append(type_)
+        sql = "SELECT msgid, revoked_at, wxid, chatroom_id, type, payload FROM revokes"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY revoked_at DESC LIMIT ?"
+        params.append(limit)
+
+        with self._lock:
+            conn = self._connect(date)
+            if conn is None:
+                return []
+            rows = conn.execute(sql, params).fetchall()
+
+        records = []
+        for msgid, revoked_at, wxid_, chatroom_id_, type_, payload in rows:
+            raw_message = zlib.decompress(payload).decode("utf-8")
+            try:
+                message = json.loads(raw_message)
+            except json.JSONDecodeError:
+                message = raw_message
+            records.append(
+                RevokeRecord(
+                    msgid=msgid,
+                    revoked_at=datetime.datetime.fromtimestamp(revoked_at),
+                    wxid=wxid_,
+                    chatroom_id=chatroom_id_,
+                    type=type_,
+                    message=message,
+                )
+            )
+        return records
+
+    async def _run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        ctx = contextvars.copy_context()
+        func_call = functools.partial(ctx.run, func, *args, **kwargs)
+        return await loop.run_in_executor(None, func_call)
+
+    async def async_add(self, *args, **kwargs):
+        return await self._run(self.add, *args, **kwargs)
+
+    async def async_query(self, *args, **kwargs) -> List[RevokeRecord]:
+        return await self._run(self.query, *args, **kwargs)
+
+    def close(self):
+        with self._lock:
+            for conn in self._connections.values():
+                conn.close()
+            self._connections.clear()
+        return True
@@ -16,9 +16,22 @@ class Settings(BaseSettings):
     REPEATER_CHATROOM_IDS: list[str] | str = "all"
     CHATTER_CHATROOM_IDS: list[str] | str = "all"
     REVOKE_BLOCKER_WXIDS: list[str] | str = "all"
+    REVOKE_ARCHIVE_DIR: str | pathlib.Path = ROOT_DIR.joinpath("cache", "revokes")
+    REVOKE_ARCHIVE_RETENTION_DAYS: int = 30
     PRIVATE_CHATTER_SENDER_IDS: list[str] | str = "all"
     LOG_LEVEL: str = "INFO"
     ADMIN_WXIDS: list[str] | str = []
+    REPLY_MAX_CHUNK_SIZE: int = 2000
+    REPLY_TARGET_SECONDS: float = 2.0
+    REPLY_FILE_THRESHOLD: int = 3000
+    REPLY_FILE_DIR: str | pathlib.Path = None
+    REPLY_SUMMARY_FIRST: bool = False
+    WORKERS: int = 0
+    WORKER_ID: int = None
+    SIMULATION_PROFILE: str = None
+    SIMULATION_SEED: int = 0
+    SIMULATION_RPC_LATENCY: float = 0.05
+    SIMULATION_FAULT_RATE: float = 0.0
 
     class Config:
         env_file = ".env"
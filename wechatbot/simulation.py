@@ -0,0 +1,695 @@
+"""
+本地模拟的WhoChat，不需要Windows微信即可跑通整个消息处理流程
+
+事件循环使用虚拟时钟，没有IO时直接跳到下一个定时器，Redis和ChatGPT也替换为进程内的实现，
+配合固定的随机种子，同一个流量脚本每次运行的结果都一样
+"""
+import asyncio
+import copy
+import dataclasses
+import datetime
+import fnmatch
+import json
+import logging
+import random
+import selectors
+import shutil
+import statistics
+import tempfile
+from typing import Awaitable, Callable, Dict, List, Tuple
+
+from redis.exceptions import ResponseError
+
+from wechatbot.delivery import default_send_latency
+from wechatbot.revoke_archive import RevokeArchive
+
+logger = logging.getLogger("wechatbot")
+
+default_self_wxid = "wxid_simulated_bot"
+
+# 虚拟时间0对应的日期时间
+default_epoch = datetime.datetime(2023, 6, 1, 8, 0, 0)
+
+
+class SimulatedFault(Exception):
+    pass
+
+
+class _VirtualTimeSelector(selectors.DefaultSelector):
+    def __init__(self, loop: "VirtualClockEventLoop"):
+        super().__init__()
+        self.loop = loop
+
+    def select(self, timeout=None):
+        events = super().select(0)
+        if events or timeout == 0:
+            return events
+        if timeout is None:
+            # 没有定时器，只能等待真实IO
+            return super().select(None)
+        self.loop.advance(timeout)
+        return []
+
+
+class VirtualClockEventLoop(asyncio.SelectorEventLoop):
+    """
+    loop.time()返回虚拟时间，asyncio.sleep不会真正等待
+
+    没有就绪的IO时虚拟时间直接跳到下一个定时器，所以不能有真实的网络IO(如Redis)，
+    否则会在响应返回前跳过时间；simulate会把它们替换为进程内的实现
+    """
+
+    def __init__(self):
+        self._virtual_time = 0.0
+        super().__init__(selector=_VirtualTimeSelector(self))
+
+    def time(self):
+        return self._virtual_time
+
+    def advance(self, seconds: float):
+        self._virtual_time += max(seconds, 0)
+
+    def run_in_executor(self, executor, func, *args):
+        # 直接在事件循环中执行: 执行期间虚拟时间不前进，多个任务的完成顺序也是确定的
+        future = self.create_future()
+        try:
+            future.set_result(func(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+class _StreamGroup:
+    def __init__(self, last_delivered_id: int):
+        self.last_delivered_id = last_delivered_id
+        # 已读取未确认的消息: entry_id -> consumer
+        self.pending: Dict[int, bytes] = {}
+
+
+class SimulatedRedis:
+    """
+    进程内的Redis，只实现了bot和多进程模式用到的命令，过期时间使用事件循环的(虚拟)时间
+
+    Stream的ID为"{序号}-0"，只支持xadd自动生成
+    """
+
+    def __init__(self):
+        self._data: Dict[bytes, bytes | Dict[bytes, bytes]] = {}
+        self._expire_at: Dict[bytes, float] = {}
+        self._streams: Dict[bytes, Dict[int, Dict[bytes, bytes]]] = {}
+        self._groups: Dict[Tuple[bytes, bytes], _StreamGroup] = {}
+        self._last_stream_id = 0
+        self._stream_added: asyncio.Event | None = None
+
+    @staticmethod
+    def _encode(value) -> bytes:
+        if isinstance(value, bytes):
+            return value
+        return str(value).encode("utf-8")
+
+    @staticmethod
+    def _now() -> float:
+        return asyncio.get_running_loop().time()
+
+    def _lookup(self, name):
+        key = self._encode(name)
+        if key in self._expire_at and self._expire_at[key] <= self._now():
+            self._data.pop(key, None)
+            self._expire_at.pop(key, None)
+        return self._data.get(key)
+
+    async def get(self, name):
+        return self._lookup(name)
+
+    async def set(self, name, value, ex=None):
+        key = self._encode(name)
+        self._data[key] = self._encode(value)
+        self._expire_at.pop(key, None)
+        if ex is not None:
+            self._expire_at[key] = self._now() + ex
+        return True
+
+    async def ttl(self, name):
+        if self._lookup(name) is None:
+            return -2
+        expire_at = self._expire_at.get(self._encode(name))
+        if expire_at is None:
+            return -1
+        return round(expire_at - self._now())
+
+    async def exists(self, *names):
+        return sum(self._lookup(name) is not None for name in names)
+
+    async def delete(self, *names):
+        deleted = 0
+        for name in names:
+            if self._lookup(name) is not None:
+                key = self._encode(name)
+                del self._data[key]
+                self._expire_at.pop(key, None)
+                deleted += 1
+        return deleted
+
+    async def hset(self, name, key=None, value=None, mapping=None):
+        mapping = dict(mapping or {})
+        if key is not None:
+            mapping[key] = value
+        hash_ = self._lookup(name)
+        if hash_ is None:
+            hash_ = self._data[self._encode(name)] = {}
+        for field, field_value in mapping.items():
+            hash_[self._encode(field)] = self._encode(field_value)
+        return len(mapping)
+
+    async def hgetall(self, name):
+        return dict(self._lookup(name) or {})
+
+    async def scan_iter(self, match=None, _type=None):
+        for key in list(self._data):
+            value = self._lookup(key)
+            if value is None:
+                continue
+            if match and not fnmatch.fnmatchcase(key.decode("utf-8"), match):
+                continue
+            if _type and (_type.upper() == "HASH") != isinstance(value, dict):
+                continue
+            yield key
+
+    @staticmethod
+    def _parse_stream_id(entry_id) -> int:
+        if isinstance(entry_id, bytes):
+            entry_id = entry_id.decode()
+        return int(str(entry_id).split("-")[0])
+
+    @staticmethod
+    def _format_stream_id(entry_id: int) -> bytes:
+        return f"{entry_id}-0".encode()
+
+    def _group(self, name, groupname) -> _StreamGroup:
+        group = self._groups.get((self._encode(name), self._encode(groupname)))
+        if group is None:
+            raise ResponseError("NOGROUP No such key or consumer group")
+        return group
+
+    async def xadd(self, name, fields, id="*", maxlen=None, approximate=True):
+        stream = self._streams.setdefault(self._encode(name), {})
+        self._last_stream_id += 1
+        stream[self._last_stream_id] = {
+            self._encode(field): self._encode(value) for field, value in fields.items()
+        }
+        if maxlen is not None:
+            for entry_id in list(stream)[: max(len(stream) - maxlen, 0)]:
+                del stream[entry_id]
+        if self._stream_added is not None:
+            self._stream_added.set()
+            self._stream_added = None
+        return self._format_stream_id(self._last_stream_id)
+
+    async def xlen(self, name):
+        return len(self._streams.get(self._encode(name), {}))
+
+    async def xgroup_create(self, name, groupname, id="$", mkstream=False):
+        key = self._encode(name)
+        if key not in self._streams:
+            if not mkstream:
+                raise ResponseError(
+                    "ERR The XGROUP subcommand requires the key to exist"
+                )
+            self._streams[key] = {}
+        if (key, self._encode(groupname)) in self._groups:
+            raise ResponseError("BUSYGROUP Consumer Group name already exists")
+        last_delivered_id = (
+            self._last_stream_id if id == "$" else self._parse_stream_id(id)
+        )
+        self._groups[key, self._encode(groupname)] = _StreamGroup(last_delivered_id)
+        return True
+
+    def _read_group(self, name, groupname, consumername, entry_id, count):
+        stream = self._streams.get(self._encode(name), {})
+        group = self._group(name, groupname)
+        consumer = self._encode(consumername)
+        if entry_id in (">", b">"):
+            ids = [i for i in stream if i > group.last_delivered_id][:count]
+            for i in ids:
+                group.pending[i] = consumer
+            if ids:
+                group.last_delivered_id = ids[-1]
+        else:
+            start = self._parse_stream_id(entry_id)
+            ids = sorted(
+                i for i, c in group.pending.items() if c == consumer and i > start
+            )[:count]
+        return [(self._format_stream_id(i), stream.get(i)) for i in ids]
+
+    async def xreadgroup(
+        self, groupname, consumername, streams, count=None, block=None, noack=False
+    ):
+        response = []
+        for name, entry_id in streams.items():
+            entries = self._read_group(name, groupname, consumername, entry_id, count)
+            if not entries and entry_id in (">", b">") and block is not None:
+                if self._stream_added is None:
+                    self._stream_added = asyncio.Event()
+                try:
+                    await asyncio.wait_for(
+                        self._stream_added.wait(), block / 1000 if block else None
+                    )
+                except asyncio.TimeoutError:
+                    pass
+                entries = self._read_group(
+                    name, groupname, consumername, entry_id, count
+                )
+            if entries or entry_id not in (">", b">"):
+                response.append([self._encode(name), entries])
+        return response
+
+    async def xack(self, name, groupname, *ids):
+        group = self._group(name, groupname)
+        acked = 0
+        for entry_id in ids:
+            if group.pending.pop(self._parse_stream_id(entry_id), None) is not None:
+                acked += 1
+        return acked
+
+    async def xdel(self, name, *ids):
+        stream = self._streams.get(self._encode(name), {})
+        return sum(
+            stream.pop(self._parse_stream_id(entry_id), None) is not None
+            for entry_id in ids
+        )
+
+    async def xpending(self, name, groupname):
+        pending = self._group(name, groupname).pending
+        consumers: Dict[bytes, int] = {}
+        for consumer in pending.values():
+            consumers[consumer] = consumers.get(consumer, 0) + 1
+        return {
+            "pending": len(pending),
+            "min": self._format_stream_id(min(pending)) if pending else None,
+            "max": self._format_stream_id(max(pending)) if pending else None,
+            "consumers": [
+                {"name": name, "pending": n} for name, n in consumers.items()
+            ],
+        }
+
+
+class SimulatedChatGPT:
+    """代替ChatGPT，等待think_time秒(虚拟时间)后返回reply_length个字符左右的回答"""
+
+    def __init__(self, think_time: float = 3.0, reply_length: int = 800):
+        self.think_time = think_time
+        self.reply_length = reply_length
+        self.max_chatrooms = 1000
+        self.chatrooms: Dict[str, str] = {}
+        # 不换出到磁盘
+        self.chatroom_store: List[str] = []
+
+    def reset_chatroom(self, chatroom_id):
+        self.chatrooms.pop(chatroom_id, None)
+
+    def answer(self, prompt: str) -> str:
+        sentences = []
+        length = 0
+        while length < self.reply_length:
+            sentence = f"关于「{prompt}」的第{len(sentences) + 1}句回答。"
+            # 每5句一个段落
+            if len(sentences) % 5 == 4:
+                sentence += "\n\n"
+            sentences.append(sentence)
+            length += len(sentence)
+        return "".join(sentences)
+
+    async def async_chat(self, chatroom_id, prompt: str, parent_message_id=None):
+        await asyncio.sleep(self.think_time)
+        self.chatrooms[chatroom_id] = prompt
+        return {"text": self.answer(prompt)}
+
+
+@dataclasses.dataclass
+class LinkProfile:
+    """RPC调用的延迟(秒)和失败率"""
+
+    latency: float = 0.05
+    jitter: float = 0.0
+    fault_rate: float = 0.0
+
+
+@dataclasses.dataclass
+class SentRecord:
+    at: float
+    method: str
+    wxid: str
+    payload: str
+
+
+@dataclasses.dataclass
+class ScriptedFrame:
+    at: float
+    message: dict
+
+
+def make_message(
+    sender: str,
+    wxid: str,
+    message: str,
+    type_: int = 1,
+    at_user_list: List[str] = None,
+    is_send_msg: bool = False,
+    **extra,
+) -> dict:
+    """
+    与whochat的WechatMessageWebsocketClient推送的格式一致: 私聊消息的extrainfo为None，
+    群消息只有被@时才有at_user_list
+    """
+    if not sender.endswith("@chatroom"):
+        extrainfo = None
+    elif at_user_list:
+        extrainfo = {"is_at_msg": True, "at_user_list": at_user_list}
+    else:
+        extrainfo = {"is_at_msg": False}
+    return {
+        "type": type_,
+        "sender": sender,
+        "wxid": wxid,
+        "message": message,
+        "isSendMsg": is_send_msg,
+        "extrainfo": extrainfo,
+        **extra,
+    }
+
+
+def make_revoke_message(chatroom_id: str, wxid: str, revoked_msgid: int) -> dict:
+    return make_message(
+        chatroom_id,
+        wxid,
+        f'<sysmsg type="revokemsg"><revokemsg><session>{chatroom_id}</session>'
+        f"<newmsgid>{revoked_msgid}</newmsgid>"
+        f'<replacemsg><![CDATA["{wxid}" 撤回了一条消息]]></replacemsg>'
+        f"</revokemsg></sysmsg>",
+        type_=10002,
+    )
+
+
+class TrafficProfile:
+    def __init__(self, frames: List[ScriptedFrame]):
+        self.frames = sorted(frames, key=lambda frame: frame.at)
+
+    @classmethod
+    def load(cls, file) -> "TrafficProfile":
+        """
+        从JSONL文件加载，每行格式: {"at": 1.5, "message": {"sender": ..., "wxid": ..., "message": ...}}
+        message中缺少的字段使用make_message的默认值
+        """
+        frames = []
+        with open(file, "r", encoding="utf-8") as fp:
+            for line in fp:
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                message = dict(item["message"])
+                frames.append(
+                    ScriptedFrame(
+                        at=float(item["at"]),
+                        message=make_message(
+                            message.pop("sender"),
+                            message.pop("wxid"),
+                            message.pop("message"),
+                            type_=message.pop("type", 1),
+                            **message,
+                        ),
+                    )
+                )
+        return cls(frames)
+
+    @classmethod
+    def chatroom_traffic(
+        cls,
+        seed: int = 0,
+        chatrooms: int = 5,
+        users: int = 20,
+        rate: float = 10.0,
+        duration: float = 60.0,
+        repeat_ratio: float = 0.1,
+        at_me_ratio: float = 0.02,
+        private_ratio: float = 0.02,
+        revoke_ratio: float = 0.01,
+        self_wxid: str = default_self_wxid,
+    ) -> "TrafficProfile":
+        """
+        rate条/秒的消息，到达间隔服从指数分布，
+        包括群聊、@机器人、私聊和撤回之前发送的群消息
+        """
+        rnd = random.Random(seed)
+        words = ["早", "哈哈哈", "吃了吗", "+1", "有人吗", "在吗", "好的", "收到"]
+        frames = []
+        sent_messages = []
+        at = 0.0
+        msgid = 1000000
+        while True:
+            at += rnd.expovariate(rate)
+            if at > duration:
+                break
+            msgid += 1
+            chatroom_id = f"{rnd.randrange(chatrooms)}@chatroom"
+            wxid = f"wxid_user_{rnd.randrange(users)}"
+            r = rnd.random()
+            if r < private_ratio:
+                message = make_message(wxid, wxid, rnd.choice(words))
+            elif r < private_ratio + revoke_ratio and sent_messages:
+                revoked = rnd.choice(sent_messages)
+                message = make_revoke_message(
+                    revoked["sender"], revoked["wxid"], revoked["msgid"]
+                )
+            elif r < private_ratio + revoke_ratio + at_me_ratio:
+                message = make_message(
+                    chatroom_id, wxid, "@bot\u2005你好", at_user_list=[self_wxid]
+                )
+            elif rnd.random() < repeat_ratio:
+                message = make_message(chatroom_id, wxid, words[0])
+            else:
+                message = make_message(chatroom_id, wxid, rnd.choice(words))
+                sent_messages.append(message)
+            message["msgid"] = msgid
+            frames.append(ScriptedFrame(at=at, message=message))
+        return cls(frames)
+
+
+class SimulatedWechat:
+    def __init__(
+        self,
+        seed: int = 0,
+        link: LinkProfile = None,
+        self_wxid: str = default_self_wxid,
+        base_directory: str = "C:\\WeChat Files\\",
+    ):
+        self.random = random.Random(seed)
+        self.link = link or LinkProfile()
+        self.pid = 10000 + seed
+        self.self_wxid = self_wxid
+        self.base_directory = base_directory
+        self.sent: List[SentRecord] = []
+        self.faults = 0
+        self.received = 0
+        self.started_at: float | None = None
+        self._last_received_at: Dict[str, float] = {}
+        self._reply_delays: List[float] = []
+        self._next_msgid = 1000000
+
+    def next_msgid(self) -> int:
+        self._next_msgid += 1
+        return self._next_msgid
+
+    def receive(self, message: dict):
+        now = asyncio.get_running_loop().time()
+        if self.started_at is None:
+            self.started_at = now
+        self.received += 1
+        self._last_received_at[message["sender"]] = now
+
+    async def rpc(
+        self, method: str, wxid: str = "", payload: str = "", faultable: bool = True
+    ):
+        delay = self.link.latency + self.random.uniform(0, self.link.jitter)
+        await asyncio.sleep(delay)
+        if faultable and self.random.random() < self.link.fault_rate:
+            self.faults += 1
+            raise SimulatedFault(f"{method} 模拟失败")
+        now = asyncio.get_running_loop().time()
+        self.sent.append(SentRecord(at=now, method=method, wxid=wxid, payload=payload))
+        if wxid in self._last_received_at:
+            self._reply_delays.append(now - self._last_received_at[wxid])
+
+    def report(self, now: float) -> dict:
+        duration = now - (self.started_at or now)
+        delays = sorted(self._reply_delays)
+        sent_by_method: Dict[str, int] = {}
+        for record in self.sent:
+            sent_by_method[record.method] = sent_by_method.get(record.method, 0) + 1
+        report = {
+            "duration": round(duration, 3),
+            "received": self.received,
+            "sent": len(self.sent),
+            "sent_by_method": sent_by_method,
+            "faults": self.faults,
+            "throughput": round(self.received / duration, 3) if duration else 0,
+        }
+        if delays:
+            report.update(
+                reply_delay_p50=round(statistics.median(delays), 3),
+                reply_delay_p95=round(
+                    delays[min(int(len(delays) * 0.95), len(delays) - 1)], 3
+                ),
+                reply_delay_max=round(delays[-1], 3),
+            )
+        return report
+
+
+class SimulatedBotRPCClient:
+    """BotWebsocketRPCClient的模拟"""
+
+    def __init__(self, wechat: SimulatedWechat):
+        self.wechat = wechat
+
+    def consume_in_background(self):
+        pass
+
+    async def list_wechat(self):
+        await self.wechat.rpc("list_wechat", faultable=False)
+        return [{"pid": self.wechat.pid}]
+
+
+class SimulatedOneBotRPCClient:
+    """OneBotWebsocketRPCClient的模拟，只实现了bot用到的方法"""
+
+    def __init__(self, pid: int, bot_rpc_client: SimulatedBotRPCClient):
+        self.pid = pid
+        self.wechat = bot_rpc_client.wechat
+
+    async def get_self_info(self):
+        await self.wechat.rpc("get_self_info", faultable=False)
+        return {"wxId": self.wechat.self_wxid, "wxNickName": "bot"}
+
+    async def hook_image_msg(self, save_path: str):
+        await self.wechat.rpc("hook_image_msg", payload=save_path, faultable=False)
+        return save_path
+
+    async def hook_voice_msg(self, save_path: str):
+        await self.wechat.rpc("hook_voice_msg", payload=save_path, faultable=False)
+        return save_path
+
+    async def get_base_directory(self):
+        await self.wechat.rpc("get_base_directory", faultable=False)
+        return self.wechat.base_directory
+
+    async def prevent_revoke(self, filepath: str):
+        await self.wechat.rpc("prevent_revoke", payload=filepath)
+
+    async def send_text(self, wxid: str, text: str):
+        await self.wechat.rpc("send_text", wxid, text)
+
+    async def send_at_text(
+        self,
+        chatroom_id: str,
+        at_wxids: List[str],
+        text: str,
+        auto_nickname: bool = True,
+    ):
+        await self.wechat.rpc("send_at_text", chatroom_id, text)
+
+    async def send_image(self, wxid: str, image_path: str):
+        await self.wechat.rpc("send_image", wxid, image_path)
+
+    async def send_file(self, wxid: str, filepath: str):
+        await self.wechat.rpc("send_file", wxid, filepath)
+
+
+class SimulatedMessageClient:
+    """WechatMessageWebsocketClient的模拟，按流量脚本推送消息"""
+
+    def __init__(
+        self,
+        wechat: SimulatedWechat,
+        profile: TrafficProfile,
+        drain_timeout: float = 300,
+    ):
+        self.wechat = wechat
+        self.profile = profile
+        self.drain_timeout = drain_timeout
+
+    async def start_consumer(self, callback: Callable[[str], Awaitable]):
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        for frame in self.profile.frames:
+            await asyncio.sleep(start + frame.at - loop.time())
+            message = dict(frame.message)
+            message.setdefault("msgid", self.wechat.next_msgid())
+            self.wechat.receive(message)
+            await callback(json.dumps(message, ensure_ascii=False))
+
+        # 等待还在处理中的消息
+        current = asyncio.current_task()
+        pending = [task for task in asyncio.all_tasks() if task is not current]
+        if pending:
+            await asyncio.wait(pending, timeout=self.drain_timeout)
+
+
+def simulate(
+    main: Callable[..., Awaitable],
+    profile: str | TrafficProfile,
+    seed: int = 0,
+    link: LinkProfile = None,
+    chatgpt: SimulatedChatGPT = None,
+    wechat: SimulatedWechat = None,
+) -> dict:
+    """
+    使用模拟的WhoChat运行main，profile为JSONL流量脚本路径，或"chatroom"使用随机生成的流量
+
+    运行期间bot使用进程内的Redis、临时目录中的撤回归档和SimulatedChatGPT，
+    撤回记录的时间从default_epoch开始按虚拟时间计算，
+    不会读写真实的Redis和ChatGPT，同样的参数每次运行的结果都一样
+    """
+    from wechatbot import bot
+
+    if isinstance(profile, TrafficProfile):
+        traffic = profile
+    elif profile == "chatroom":
+        traffic = TrafficProfile.chatroom_traffic(seed=seed)
+    else:
+        traffic = TrafficProfile.load(profile)
+    wechat = wechat or SimulatedWechat(seed=seed, link=link)
+    chatgpt = chatgpt or SimulatedChatGPT()
+
+    loop = VirtualClockEventLoop()
+    consumers = [bot.chatter, bot.private_chatter]
+    saved_redis_client, saved_revoke_archive = bot.redis_client, bot.revoke_archive
+    saved_clock = bot.clock
+    saved_consumers = [(consumer._chatgpt, consumer.delivery) for consumer in consumers]
+    archive_dir = tempfile.mkdtemp(prefix="wechatbot-simulation-")
+    bot.redis_client = SimulatedRedis()
+    bot.revoke_archive = RevokeArchive(archive_dir)
+    bot.clock = lambda: default_epoch + datetime.timedelta(seconds=loop.time())
+    delivery = copy.copy(bot.reply_delivery)
+    delivery.send_latency = default_send_latency
+    for consumer in consumers:
+        consumer.chatgpt = chatgpt
+        consumer.delivery = delivery
+
+    try:
+        loop.run_until_complete(
+            main(
+                bot_rpc_client=SimulatedBotRPCClient(wechat),
+                message_client=SimulatedMessageClient(wechat, traffic),
+                one_bot_client_class=SimulatedOneBotRPCClient,
+            )
+        )
+        report = wechat.report(loop.time())
+    finally:
+        loop.close()
+        bot.revoke_archive.close()
+        shutil.rmtree(archive_dir, ignore_errors=True)
+        bot.redis_client, bot.revoke_archive = saved_redis_client, saved_revoke_archive
+        bot.clock = saved_clock
+        for consumer, (chatgpt_, delivery) in zip(consumers, saved_consumers):
+            consumer.chatgpt, consumer.delivery = chatgpt_, delivery
+    logger.info(f"模拟结束: {report}")
+    return report
@@ -0,0 +1,286 @@
+"""
+多进程模式: 主进程只负责把原始消息按群分区写入Redis Stream，
+由多个worker进程消费，回复再通过outbound stream交给主进程统一发送
+
+同一个群的消息总是落在同一个分区，由同一个worker按顺序取出处理
+"""
+import asyncio
+import bisect
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import re
+import time
+from typing import List
+
+from redis import asyncio as aredis
+from redis.exceptions import ResponseError
+
+from wechatbot.settings import settings
+
+logger = logging.getLogger("wechatbot")
+
+group_name = "wechatbot"
+outbound_stream = "wechatbot:outbound"
+# 主进程执行RPC调用的平均耗时，worker据此调整长回复的分段
+outbound_latency_key = "wechatbot:outbound:latency"
+
+sender_pattern = re.compile(rb'"sender"\s*:\s*"([^"]*)"')
+
+
+def ingress_stream(partition: int) -> str:
+    return f"wechatbot:ingress:{partition}"
+
+
+def get_redis_client() -> aredis.Redis:
+    return aredis.Redis(
+        host=settings.REDIS_HOST,
+        port=settings.REDIS_PORT,
+        password=settings.REDIS_PASSWORD,
+        db=2,
+    )
+
+
+class HashRing:
+    """一致性哈希，worker数量变化时只有少部分群会换分区"""
+
+    def __init__(self, nodes: List[int], replicas: int = 100):
+        self._ring = sorted(
+            (self._hash(f"{node}:{i}"), node) for node in nodes for i in range(replicas)
+        )
+        self._keys = [key for key, _ in self._ring]
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int(hashlib.md5(key.encode("utf-8")).hexdigest()[:16], 16)
+
+    def get(self, key: str) -> int:
+        index = bisect.bisect(self._keys, self._hash(key)) % len(self._keys)
+        return self._ring[index][1]
+
+
+async def create_group(redis_client: aredis.Redis, stream: str):
+    """
+    创建consumer group；已存在时沿用原来的读取位置，
+    上次运行遗留的消息(包括已读取但未确认的)都会继续处理
+    """
+    try:
+        await redis_client.xgroup_create(stream, group_name, id="$", mkstream=True)
+    except ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+async def read_group(redis_client: aredis.Redis, stream: str, consumer: str):
+    """
+    按顺序迭代stream中的(entry_id, fields)，调用方处理完成后调用ack；
+    先取回该consumer已读取但未确认的消息(如worker重启前未处理完的)，再读取新消息
+    """
+    last_id = "0"
+    while True:
+        response = await redis_client.xreadgroup(
+            group_name, consumer, {stream: last_id}, count=100, block=5000
+        )
+        entries = response[0][1] if response else []
+        if last_id != ">":
+            if not entries:
+                last_id = ">"
+                continue
+            # 未确认的消息还在pending列表中，从最后一条之后继续取
+            last_id = entries[-1][0]
+        for entry_id, fields in entries:
+            yield entry_id, fields
+
+
+async def ack(redis_client: aredis.Redis, stream: str, entry_id):
+    """确认消息已处理并从stream中删除"""
+    await redis_client.xack(stream, group_name, entry_id)
+    await redis_client.xdel(stream, entry_id)
+
+
+class OutboundRPCClient:
+    """worker进程中代替OneBotWebsocketRPCClient，把调用写入outbound stream"""
+
+    def __init__(self, redis_client: aredis.Redis):
+        self.redis_client = redis_client
+
+    async def call(self, method: str, *args):
+        await self.redis_client.xadd(
+            outbound_stream,
+            {"method": method, "args": json.dumps(args, ensure_ascii=False)},
+        )
+
+    async def get_send_latency(self) -> float | None:
+        """写入stream的耗时不代表真实发送耗时，使用主进程统计的RPC耗时"""
+        latency = await self.redis_client.get(outbound_latency_key)
+        return float(latency) if latency else None
+
+    async def prevent_revoke(self, filepath: str):
+        await self.call("prevent_revoke", filepath)
+
+    async def send_text(self, wxid: str, text: str):
+        await self.call("send_text", wxid, text)
+
+    async def send_at_text(
+        self,
+        chatroom_id: str,
+        at_wxids: List[str],
+        text: str,
+        auto_nickname: bool = True,
+    ):
+        await self.call("send_at_text", chatroom_id, at_wxids, text, auto_nickname)
+
+    async def send_image(self, wxid: str, image_path: str):
+        await self.call("send_image", wxid, image_path)
+
+    async def send_file(self, wxid: str, filepath: str):
+        await self.call("send_file", wxid, filepath)
+
+
+class Ingress:
+    # worker启动后这么多秒内退出视为启动失败，不再重启
+    min_worker_uptime = 10
+    supervise_interval = 1
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.ring = HashRing(list(range(workers)))
+        self.redis_client = get_redis_client()
+        self.processes: List[multiprocessing.Process] = []
+        self._started_at: List[float] = []
+        self.send_latency: float | None = None
+
+    def partition(self, raw_message: str | bytes) -> int:
+        if isinstance(raw_message, str):
+            raw_message = raw_message.encode("utf-8")
+        m = sender_pattern.search(raw_message)
+        sender = m.group(1) if m else json.loads(raw_message)["sender"].encode()
+        return self.ring.get(sender.decode("utf-8"))
+
+    async def push(self, raw_message: str | bytes):
+        # 不设置maxlen，消息在worker确认后删除，不能丢弃还未处理的消息
+        await self.redis_client.xadd(
+            ingress_stream(self.partition(raw_message)), {"raw": raw_message}
+        )
+
+    async def relay_outbound(self, o):
+        """按写入顺序执行worker发来的RPC调用，并统计调用耗时"""
+        loop = asyncio.get_running_loop()
+        async for entry_id, fields in read_group(
+            self.redis_client, outbound_stream, "ingress"
+        ):
+            method = fields[b"method"].decode()
+            args = json.loads(fields[b"args"])
+            start = loop.time()
+            try:
+                await getattr(o, method)(*args)
+            except Exception as e:
+                logger.error(f"执行worker的RPC调用出错: {method}")
+                logger.exception(e)
+            else:
+                latency = loop.time() - start
+                if self.send_latency is None:
+                    self.send_latency = latency
+                else:
+                    self.send_latency = 0.8 * self.send_latency + 0.2 * latency
+                await self.redis_client.set(outbound_latency_key, self.send_latency)
+            await ack(self.redis_client, outbound_stream, entry_id)
+
+    def start_worker(self, worker_id: int, context: dict) -> multiprocessing.Process:
+        # 使用spawn，避免worker继承主进程已经加载的ChatGPT等状态
+        mp_context = multiprocessing.get_context("spawn")
+        # settings在子进程中从环境变量读取WORKER_ID
+        os.environ["WORKER_ID"] = str(worker_id)
+        try:
+            process = mp_context.Process(
+                target=worker_main,
+                args=(worker_id, context),
+                name=f"wechatbot-worker-{worker_id}",
+                daemon=True,
+            )
+            process.start()
+        finally:
+            os.environ.pop("WORKER_ID", None)
+        return process
+
+    def start_workers(self, context: dict):
+        for worker_id in range(self.workers):
+            self.processes.append(self.start_worker(worker_id, context))
+            self._started_at.append(time.monotonic())
+
+    async def supervise(self, context: dict):
+        """worker退出后重启，启动后很快又退出的说明无法正常运行，结束整个程序"""
+        while True:
+            await asyncio.sleep(self.supervise_interval)
+            for worker_id, process in enumerate(self.processes):
+                if process.is_alive():
+                    continue
+                uptime = time.monotonic() - self._started_at[worker_id]
+                logger.error(
+                    f"worker {worker_id} 已退出, exitcode: {process.exitcode}, 运行了{uptime:.1f}秒"
+                )
+                if uptime < self.min_worker_uptime:
+                    raise RuntimeError(f"worker {worker_id} 无法正常运行")
+                self.processes[worker_id] = self.start_worker(worker_id, context)
+                self._started_at[worker_id] = time.monotonic()
+                logger.info(f"worker {worker_id} 已重启")
+
+    async def run(self, o, message_client, context: dict):
+        await create_group(self.redis_client, outbound_stream)
+        for partition in range(self.workers):
+            await create_group(self.redis_client, ingress_stream(partition))
+        self.start_workers(context)
+        logger.info(f"已启动{self.workers}个worker进程")
+        tasks = [
+            asyncio.create_task(self.relay_outbound(o)),
+            asyncio.create_task(self.supervise(context)),
+            asyncio.create_task(message_client.start_consumer(self.push)),
+        ]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                task.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+            for process in self.processes:
+                process.terminate()
+
+
+async def consume_partition(worker_id: int, redis_client: aredis.Redis = None):
+    """
+    与单进程模式一样按顺序取出消息并发处理，处理完成后才确认并删除，
+    worker退出时还没处理完的消息在重启后重新处理
+    """
+    from wechatbot import bot
+
+    redis_client = redis_client or get_redis_client()
+    o = OutboundRPCClient(redis_client)
+    stream = ingress_stream(worker_id)
+    tasks = set()
+
+    async def handle(entry_id, raw_message: bytes):
+        try:
+            await bot._on_message(raw_message, o)
+        except Exception as e:
+            # 无法处理的消息也要确认，否则每次重启都会重新处理
+            logger.error(f"worker {worker_id} 处理消息出错: {raw_message}")
+            logger.exception(e)
+        await ack(redis_client, stream, entry_id)
+
+    async for entry_id, fields in read_group(
+        redis_client, stream, f"worker-{worker_id}"
+    ):
+        task = asyncio.create_task(handle(entry_id, fields[b"raw"]))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+
+def worker_main(worker_id: int, context: dict):
+    from wechatbot.bot import global_context
+
+    global_context.update(context)
+    logger.info(f"worker {worker_id} 已启动")
+    asyncio.run(consume_partition(worker_id))